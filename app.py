@@ -1,39 +1,113 @@
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
+from quart import Quart, request, jsonify, send_from_directory
+from quart.json.provider import JSONProvider
+from quart_cors import cors
 import os
-import json
+import asyncio
+import hashlib
+import orjson
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from model.plaque_detector import PlaqueDetector
 from utils.image_processor import ImageProcessor
+from utils.annotation_store import AnnotationStore
 
-app = Flask(__name__, static_folder='static')
-CORS(app)
+
+class OrjsonProvider(JSONProvider):
+    """Serialize request and response bodies with orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+app = Quart(__name__, static_folder='static')
+app.json = OrjsonProvider(app)
+app = cors(app)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ANNOTATIONS_FOLDER = 'annotations'
 MODEL_FOLDER = 'model/checkpoints'
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # copy uploads to disk 1 MiB at a time
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(ANNOTATIONS_FOLDER, exist_ok=True)
 os.makedirs(MODEL_FOLDER, exist_ok=True)
 
+# Feedback for every analyzed image
+ANNOTATION_DB = os.path.join(ANNOTATIONS_FOLDER, 'annotations.db')
+
+# Detections for recently uploaded images, keyed by a hash of the file
+# contents, so re-uploading the same image skips detection. Only touched from
+# the event loop, so it needs no lock.
+DETECTION_CACHE_SIZE = 256
+_detection_cache = OrderedDict()
+
 # Initialize detector
 detector = PlaqueDetector()
-image_processor = ImageProcessor()
+image_processor = ImageProcessor(preview_scale=True)
+annotation_store = AnnotationStore(ANNOTATION_DB, legacy_folder=ANNOTATIONS_FOLDER)
+
+# Blocking work (OpenCV, disk, torch) runs here so it never stalls the event
+# loop; OpenCV releases the GIL, so detections scale across cores
+cv_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
+async def run_blocking(func, *args):
+    """Run ``func(*args)`` on the worker pool and await its result"""
+    return await asyncio.get_running_loop().run_in_executor(cv_pool, func, *args)
+
+
+async def run_io(func, *args):
+    """Run small blocking file I/O on the loop's default executor
+
+    Kept off ``cv_pool`` so feedback writes never queue behind detections.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def _save_upload(file, filepath):
+    """Copy an uploaded file to disk, returning a hash of its contents"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'wb') as f:
+        while True:
+            chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+async def detect_cached(filepath, digest):
+    """Detect plaques, reusing the result for an identical earlier upload"""
+    detections = _detection_cache.get(digest)
+    if detections is not None:
+        _detection_cache.move_to_end(digest)
+        return detections
+
+    detections = await run_blocking(detector.detect, filepath)
+    _detection_cache[digest] = detections
+    if len(_detection_cache) > DETECTION_CACHE_SIZE:
+        _detection_cache.popitem(last=False)
+    return detections
 
 
 @app.route('/')
-def index():
-    return send_from_directory('static', 'index.html')
+async def index():
+    return await send_from_directory('static', 'index.html')
 
 
 @app.route('/api/upload', methods=['POST'])
-def upload_image():
+async def upload_image():
     """Handle image upload and perform plaque detection"""
-    if 'image' not in request.files:
+    files = await request.files
+    if 'image' not in files:
         return jsonify({'error': 'No image provided'}), 400
 
-    file = request.files['image']
+    file = files['image']
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
 
@@ -41,14 +115,15 @@ def upload_image():
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"{timestamp}_{file.filename}"
     filepath = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(filepath)
+    digest = await run_io(_save_upload, file, filepath)
 
     try:
         # Process image and detect plaques
-        detections = detector.detect(filepath)
+        detections = await detect_cached(filepath, digest)
 
         # Generate visualization
-        viz_path = image_processor.create_visualization(
+        viz_path = await run_blocking(
+            image_processor.create_visualization,
             filepath,
             detections,
             os.path.join(UPLOAD_FOLDER, f"viz_{filename}")
@@ -70,19 +145,14 @@ def upload_image():
 
 
 @app.route('/api/feedback', methods=['POST'])
-def submit_feedback():
+async def submit_feedback():
     """Store user feedback for model improvement"""
-    data = request.json
+    data = await request.get_json()
 
     if not data or 'image_id' not in data:
         return jsonify({'error': 'Invalid feedback data'}), 400
 
     # Save annotation data
-    annotation_file = os.path.join(
-        ANNOTATIONS_FOLDER,
-        f"{data['image_id']}.json"
-    )
-
     annotation_data = {
         'image_id': data['image_id'],
         'actual_count': data.get('actual_count'),
@@ -90,22 +160,17 @@ def submit_feedback():
         'timestamp': datetime.now().isoformat()
     }
 
-    with open(annotation_file, 'w') as f:
-        json.dump(annotation_data, f, indent=2)
+    await run_io(annotation_store.save, annotation_data)
 
     return jsonify({'message': 'Feedback saved successfully'})
 
 
 @app.route('/api/retrain', methods=['POST'])
-def retrain_model():
+async def retrain_model():
     """Trigger model retraining with accumulated feedback"""
     try:
         # Load all annotations
-        annotations = []
-        for filename in os.listdir(ANNOTATIONS_FOLDER):
-            if filename.endswith('.json'):
-                with open(os.path.join(ANNOTATIONS_FOLDER, filename), 'r') as f:
-                    annotations.append(json.load(f))
+        annotations = await run_io(annotation_store.all)
 
         if len(annotations) < 5:
             return jsonify({
@@ -114,7 +179,7 @@ def retrain_model():
             }), 400
 
         # Retrain model
-        detector.retrain(annotations, UPLOAD_FOLDER)
+        await run_blocking(detector.retrain, annotations, UPLOAD_FOLDER)
 
         return jsonify({'message': f'Model retrained with {len(annotations)} samples'})
 
@@ -123,9 +188,9 @@ def retrain_model():
 
 
 @app.route('/api/stats', methods=['GET'])
-def get_stats():
+async def get_stats():
     """Get statistics about annotations and model"""
-    annotation_count = len([f for f in os.listdir(ANNOTATIONS_FOLDER) if f.endswith('.json')])
+    annotation_count = await run_io(annotation_store.count)
 
     return jsonify({
         'annotation_count': annotation_count,
@@ -134,8 +199,8 @@ def get_stats():
 
 
 @app.route('/uploads/<path:filename>')
-def serve_upload(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+async def serve_upload(filename):
+    return await send_from_directory(UPLOAD_FOLDER, filename)
 
 
 if __name__ == '__main__':
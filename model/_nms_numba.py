@@ -0,0 +1,54 @@
+import math
+import numba
+import numpy as np
+
+
+@numba.njit(cache=True)
+def circle_iou(d2, r1, r2):
+    """Scalar version of ``plaque_detector._circle_iou``"""
+    d = math.sqrt(d2)
+    if d >= r1 + r2:
+        return 0.0
+    if d <= abs(r1 - r2):
+        inter = math.pi * min(r1, r2) ** 2
+    else:
+        c1 = min(max((d2 + r1 * r1 - r2 * r2) / (2 * d * r1), -1.0), 1.0)
+        c2 = min(max((d2 + r2 * r2 - r1 * r1) / (2 * d * r2), -1.0), 1.0)
+        kite = max((r1 + r2 - d) * (d + r1 - r2) * (d - r1 + r2) * (d + r1 + r2), 0.0)
+        inter = r1 * r1 * math.acos(c1) + r2 * r2 * math.acos(c2) - 0.5 * math.sqrt(kite)
+    return inter / (math.pi * (r1 * r1 + r2 * r2) - inter)
+
+
+@numba.njit(cache=True)
+def nms_circles(xs, ys, rs, order, overlap_thresh):
+    """Greedy circle NMS over float32 arrays, visiting circles in ``order``
+
+    Same rule as ``PlaqueDetector.non_max_suppression``: a circle is dropped
+    when its IoU with an already kept one exceeds ``overlap_thresh``.
+    Returns the kept indices.
+    """
+    n = xs.shape[0]
+    alive = np.ones(n, dtype=np.bool_)
+    picked = np.empty(n, dtype=np.int64)
+    count = 0
+
+    for k in range(n):
+        i = order[k]
+        if not alive[i]:
+            continue
+        picked[count] = i
+        count += 1
+
+        for j in range(n):
+            if alive[j]:
+                dx = float(xs[i] - xs[j])
+                dy = float(ys[i] - ys[j])
+                if circle_iou(dx * dx + dy * dy, float(rs[i]), float(rs[j])) > overlap_thresh:
+                    alive[j] = False
+
+    return picked[:count]
+
+
+# Compile (or load from cache) at import so the first request doesn't pay for it
+_empty = np.zeros(1, dtype=np.float32)
+nms_circles(_empty, _empty, _empty, np.zeros(1, dtype=np.int64), 0.5)
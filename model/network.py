@@ -0,0 +1,28 @@
+import torch.nn as nn
+import torchvision.models as models
+
+
+class PlaqueDetectionModel(nn.Module):
+    """CNN model for plaque feature extraction and classification"""
+
+    def __init__(self):
+        super(PlaqueDetectionModel, self).__init__()
+        # Use ResNet18 as backbone
+        resnet = models.resnet18(weights=models.ResNet18_Weights.DEFAULT)
+        # Remove final FC layer
+        self.features = nn.Sequential(*list(resnet.children())[:-2])
+
+        # Add custom layers for plaque detection
+        self.classifier = nn.Sequential(
+            nn.AdaptiveAvgPool2d((1, 1)),
+            nn.Flatten(),
+            nn.Linear(512, 256),
+            nn.ReLU(),
+            nn.Dropout(0.5),
+            nn.Linear(256, 2)  # plaque vs background
+        )
+
+    def forward(self, x):
+        features = self.features(x)
+        output = self.classifier(features)
+        return output
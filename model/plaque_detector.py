@@ -1,221 +1,470 @@
-import torch
-import torch.nn as nn
-import torchvision.models as models
-import torchvision.transforms as transforms
 import cv2
 import numpy as np
-from skimage import measure, morphology
-from scipy import ndimage
+from PIL import Image
 import os
 import json
-
-
-class PlaqueDetectionModel(nn.Module):
-    """CNN model for plaque feature extraction and classification"""
-
-    def __init__(self):
-        super(PlaqueDetectionModel, self).__init__()
-        # Use ResNet18 as backbone
-        resnet = models.resnet18(pretrained=True)
-        # Remove final FC layer
-        self.features = nn.Sequential(*list(resnet.children())[:-2])
-
-        # Add custom layers for plaque detection
-        self.classifier = nn.Sequential(
-            nn.AdaptiveAvgPool2d((1, 1)),
-            nn.Flatten(),
-            nn.Linear(512, 256),
-            nn.ReLU(),
-            nn.Dropout(0.5),
-            nn.Linear(256, 2)  # plaque vs background
-        )
-
-    def forward(self, x):
-        features = self.features(x)
-        output = self.classifier(features)
-        return output
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.opencv_helpers import ThreadLocalCLAHE, cuda_device_count
+
+try:
+    import onnxruntime as ort
+except ImportError:  # optional: PyTorch is used for inference instead
+    ort = None
+
+try:
+    from model._nms_numba import nms_circles
+except ImportError:  # optional: NMS falls back to NumPy
+    nms_circles = None
+
+CHECKPOINT_PATH = 'model/checkpoints/latest.pth'
+VERSION_PATH = 'model/checkpoints/latest.json'
+ONNX_PATH = 'model/checkpoints/latest.onnx'
+
+# Above this many candidates the compiled NMS beats the NumPy version
+NUMBA_NMS_MIN_DETECTIONS = 32
+
+# The NumPy NMS builds N x N IoU matrices up to this many candidates (a few
+# MB) and switches to an O(N)-memory sweep above it
+NMS_PAIRWISE_MAX_DETECTIONS = 512
+
+# Images are downscaled so their long side is at most this many pixels before
+# segmentation; Hough cost grows with pixel count
+MAX_DETECTION_DIM = 1024
+
+# JPEGs are decoded at 1/2, 1/4 or 1/8 size (libjpeg scales in the DCT
+# domain) when that still leaves at least MAX_DETECTION_DIM on the long side
+_JPEG_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Shared by all detectors; segment_plaques runs the Hough transform here
+# while thresholding runs on the calling thread, since OpenCV releases the GIL
+_segment_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix='segment')
+
+
+def _circle_iou(d2, r1, r2):
+    """Intersection over union of circles with radii ``r1``, ``r2`` whose
+    centres are ``sqrt(d2)`` apart; broadcasts like a NumPy ufunc"""
+    d = np.sqrt(d2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Area of the lens where the circles cross
+        c1 = np.clip((d2 + r1 ** 2 - r2 ** 2) / (2 * d * r1), -1, 1)
+        c2 = np.clip((d2 + r2 ** 2 - r1 ** 2) / (2 * d * r2), -1, 1)
+        kite = np.maximum((r1 + r2 - d) * (d + r1 - r2) * (d - r1 + r2) * (d + r1 + r2), 0)
+        lens = r1 ** 2 * np.arccos(c1) + r2 ** 2 * np.arccos(c2) - 0.5 * np.sqrt(kite)
+
+        inter = np.where(d >= r1 + r2, 0,
+                         np.where(d <= np.abs(r1 - r2),
+                                  np.pi * np.minimum(r1, r2) ** 2, lens))
+        return inter / (np.pi * (r1 ** 2 + r2 ** 2) - inter)
+
+
+def _read_for_detection(image_path):
+    """Decode an image no larger than detection needs
+
+    Returns the BGR image and the long side of the image at full
+    resolution. Only the header is parsed up front; non-JPEG files, and
+    files too large for Pillow's decompression bomb check, are decoded at
+    full resolution.
+    """
+    try:
+        with Image.open(image_path) as im:
+            fmt, full_dim = im.format, max(im.size)
+    except (OSError, Image.DecompressionBombError):
+        fmt, full_dim = None, None
+
+    flags = cv2.IMREAD_COLOR
+    if fmt == 'JPEG':
+        for factor, reduced in _JPEG_REDUCED_FLAGS:
+            if full_dim // factor >= MAX_DETECTION_DIM:
+                flags = reduced
+                break
+
+    img = cv2.imread(image_path, flags)
+    if img is not None and full_dim is None:
+        full_dim = max(img.shape[:2])
+    return img, full_dim
 
 
 class PlaqueDetector:
     """Main plaque detection class combining traditional CV and deep learning"""
 
     def __init__(self):
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.model = PlaqueDetectionModel().to(self.device)
-        self.model_version = 0
+        # torch and the CNN are only loaded when first needed (see ``model``);
+        # the version is read from a small sidecar file so reporting it
+        # doesn't require them
+        try:
+            with open(VERSION_PATH, 'r') as f:
+                self.model_version = json.load(f)['version']
+        except FileNotFoundError:
+            self.model_version = 0
+            # Checkpoints saved before the sidecar existed only record their
+            # version internally, so load the model once to read it and
+            # write the sidecar for later startups. A fresh install has no
+            # checkpoint and skips this, so it never imports torch here.
+            if os.path.exists(CHECKPOINT_PATH):
+                self._ensure_model_loaded()
+                self._write_version()
+
+        # Serve inference from an exported ONNX graph when onnxruntime is
+        # installed; the PyTorch model is then only needed for retraining
+        self.onnx_session = None
+        if ort is not None and os.path.exists(ONNX_PATH):
+            self.load_onnx(ONNX_PATH)
+
+        # The opening kernel never changes
+        self._morph_kernel = np.ones((3, 3), np.uint8)
+
+        # Run blur, CLAHE and Hough on the GPU when OpenCV was built with CUDA.
+        # The filter objects hold device buffers, so calls are serialized.
+        self.use_cuda = cuda_device_count() > 0
+        if self.use_cuda:
+            self._cuda_lock = threading.Lock()
+            self._gauss_cuda = cv2.cuda.createGaussianFilter(
+                cv2.CV_8UC1, cv2.CV_8UC1, (9, 9), 2
+            )
+            self._clahe_cuda = cv2.cuda.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            self._hough_cuda = cv2.cuda.createHoughCirclesDetector(
+                dp=1.2,
+                minDist=20,
+                cannyThreshold=50,
+                votesThreshold=30,
+                minRadius=5,
+                maxRadius=50
+            )
+
+        # Enhanced working images keyed by (path, mtime, size), so repeated
+        # detections on the same file skip decode and preprocessing. Only the
+        # downscaled result is kept, never the full-resolution decode.
+        self._load_enhanced = functools.lru_cache(maxsize=4)(self._load_enhanced)
+
+    clahe = ThreadLocalCLAHE(clip_limit=2.0)
+
+    @functools.cached_property
+    def device(self):
+        """Device the CNN runs on"""
+        import torch
+        return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    @functools.cached_property
+    def model(self):
+        """The CNN, built and loaded from the latest checkpoint on first use"""
+        import torch
+        from model.network import PlaqueDetectionModel
+
+        model = PlaqueDetectionModel().to(self.device)
 
         # Load checkpoint if exists
-        checkpoint_path = 'model/checkpoints/latest.pth'
-        if os.path.exists(checkpoint_path):
-            self.load_model(checkpoint_path)
-
-        self.transform = transforms.Compose([
+        try:
+            checkpoint = torch.load(CHECKPOINT_PATH, map_location=self.device,
+                                    weights_only=True)
+        except FileNotFoundError:
+            pass
+        else:
+            model.load_state_dict(checkpoint['model_state_dict'])
+            self.model_version = checkpoint.get('version', 0)
+            print(f"Loaded model version {self.model_version}")
+
+        # Inference only outside retrain: disable dropout and use NHWC layout,
+        # which cuDNN maps onto tensor cores
+        model.eval()
+        return model.to(memory_format=torch.channels_last)
+
+    def _ensure_model_loaded(self):
+        """Build the CNN and load the checkpoint now rather than on first use
+
+        Loading also sets ``model_version`` from the checkpoint.
+        """
+        _ = self.model
+
+    @functools.cached_property
+    def transform(self):
+        """Normalization applied to images before they reach the CNN"""
+        import torchvision.transforms as transforms
+        return transforms.Compose([
             transforms.ToTensor(),
             transforms.Normalize(mean=[0.485, 0.456, 0.406],
                                  std=[0.229, 0.224, 0.225])
         ])
 
     def preprocess_image(self, image_path):
-        """Load and preprocess image for detection"""
-        img = cv2.imread(image_path)
+        """Load and preprocess image for detection
+
+        Returns the decoded BGR image (large JPEGs are decoded at reduced
+        size), the RGB working image (downscaled to at most
+        MAX_DETECTION_DIM on its long side), and the scale factor from full
+        resolution to the working image.
+        """
+        img, full_dim = _read_for_detection(image_path)
         if img is None:
             raise ValueError(f"Could not load image: {image_path}")
 
         # Convert to RGB
         img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        return img, img_rgb
 
-    def segment_plaques(self, image):
-        """Use traditional CV methods for initial plaque segmentation"""
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        resize = min(1.0, MAX_DETECTION_DIM / max(img.shape[:2]))
+        if resize < 1.0:
+            img_rgb = cv2.resize(img_rgb, None, fx=resize, fy=resize,
+                                 interpolation=cv2.INTER_AREA)
+
+        scale = max(img_rgb.shape[:2]) / full_dim
+        return img, img_rgb, scale
 
-        # Apply Gaussian blur
-        blurred = cv2.GaussianBlur(gray, (9, 9), 2)
+    def _load_enhanced(self, image_path, mtime, size):
+        """Decode an image and build the contrast-enhanced grayscale used for detection
 
-        # Enhance contrast
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(blurred)
+        Returns ``(enhanced, scale)``. ``mtime`` and ``size`` are only part of
+        the cache key, so a file replaced on disk is decoded again. The
+        returned array is shared between callers and must not be modified.
+        """
+        _, img_rgb, scale = self.preprocess_image(image_path)
 
-        # Detect circles (plaques) using Hough transform
-        circles = cv2.HoughCircles(
+        # Convert to grayscale
+        gray = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
+
+        if self.use_cuda:
+            # Blur and enhance on the device, downloading only the result
+            with self._cuda_lock:
+                gpu_gray = cv2.cuda_GpuMat()
+                gpu_gray.upload(gray)
+                gpu_blurred = self._gauss_cuda.apply(gpu_gray)
+                enhanced = self._clahe_cuda.apply(
+                    gpu_blurred, cv2.cuda.Stream_Null()
+                ).download()
+        else:
+            # Apply Gaussian blur
+            blurred = cv2.GaussianBlur(gray, (9, 9), 2)
+
+            # Enhance contrast
+            enhanced = self.clahe.apply(blurred)
+
+        return enhanced, scale
+
+    def _hough_circles(self, enhanced, scale=1.0):
+        """Detect circles (plaques) using Hough transform"""
+        # Distances and the vote threshold (votes grow with circumference)
+        # are tuned for full resolution; shrink them with the image
+        min_dist = 20 * scale
+        min_radius = max(1, int(round(5 * scale)))
+        max_radius = int(round(50 * scale))
+        votes = max(10, int(round(30 * scale)))
+
+        if self.use_cuda:
+            with self._cuda_lock:
+                self._hough_cuda.setMinDist(min_dist)
+                self._hough_cuda.setMinRadius(min_radius)
+                self._hough_cuda.setMaxRadius(max_radius)
+                self._hough_cuda.setVotesThreshold(votes)
+                gpu_enhanced = cv2.cuda_GpuMat()
+                gpu_enhanced.upload(enhanced)
+                gpu_circles = self._hough_cuda.detect(gpu_enhanced)
+                if gpu_circles.empty():
+                    return None
+                return gpu_circles.download()
+
+        return cv2.HoughCircles(
             enhanced,
             cv2.HOUGH_GRADIENT,
             dp=1.2,
-            minDist=20,
+            minDist=min_dist,
             param1=50,
-            param2=30,
-            minRadius=5,
-            maxRadius=50
+            param2=votes,
+            minRadius=min_radius,
+            maxRadius=max_radius
         )
 
-        detections = []
+    def segment_plaques(self, enhanced, scale=1.0):
+        """Use traditional CV methods for initial plaque segmentation
+
+        ``enhanced`` is the working image at ``scale`` times full resolution.
+        Returns float32 arrays ``(xs, ys, radii, confidences)`` in
+        full-resolution pixels; see ``to_detections`` for the dict form.
+        """
+        # Detect circles (plaques) using Hough transform in the background,
+        # while trying adaptive thresholding for irregular plaques on this
+        # thread. Neither branch modifies ``enhanced``.
+        fut_hough = _segment_pool.submit(self._hough_circles, enhanced, scale)
+        adaptive_detections = self.detect_by_thresholding(enhanced, scale)
+        circles = fut_hough.result()
+
+        # Detections are kept as parallel arrays (x, y, radius, confidence)
         if circles is not None:
-            circles = np.uint16(np.around(circles))
-            for circle in circles[0, :]:
-                x, y, r = int(circle[0]), int(circle[1]), int(circle[2])
-                detections.append({
-                    'x': x,
-                    'y': y,
-                    'radius': r,
-                    'confidence': 0.8  # Default confidence
-                })
-
-        # Also try adaptive thresholding for irregular plaques
-        adaptive_detections = self.detect_by_thresholding(enhanced)
-        detections.extend(adaptive_detections)
+            circles = np.uint16(np.around(circles))[0]
+            xs = circles[:, 0].astype(np.float32)
+            ys = circles[:, 1].astype(np.float32)
+            rs = circles[:, 2].astype(np.float32)
+        else:
+            xs = ys = rs = np.empty(0, dtype=np.float32)
+        confs = np.full(len(xs), 0.8, dtype=np.float32)  # Default confidence
+
+        adaptive_xs, adaptive_ys, adaptive_rs = adaptive_detections
+        xs = np.concatenate([xs, adaptive_xs])
+        ys = np.concatenate([ys, adaptive_ys])
+        rs = np.concatenate([rs, adaptive_rs])
+        confs = np.concatenate([confs, np.full(len(adaptive_xs), 0.7, dtype=np.float32)])
 
         # Remove overlapping detections
-        detections = self.non_max_suppression(detections)
+        pick = np.asarray(self.non_max_suppression(xs, ys, rs, confs), dtype=np.intp)
 
-        return detections
+        # Back to full-resolution pixels
+        return xs[pick] / scale, ys[pick] / scale, rs[pick] / scale, confs[pick]
+
+    def detect_by_thresholding(self, gray_image, scale=1.0):
+        """Alternative detection method using adaptive thresholding
 
-    def detect_by_thresholding(self, gray_image):
-        """Alternative detection method using adaptive thresholding"""
-        # Apply adaptive thresholding
+        Returns float32 arrays ``(xs, ys, radii)`` in working-image pixels.
+        """
+        # Apply adaptive thresholding (block size must stay odd)
         thresh = cv2.adaptiveThreshold(
             gray_image,
             255,
             cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
             cv2.THRESH_BINARY_INV,
-            blockSize=15,
+            blockSize=max(5, int(15 * scale) | 1),
             C=2
         )
 
-        # Remove small noise
-        kernel = np.ones((3, 3), np.uint8)
-        cleaned = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=2)
+        # Remove small noise; fewer passes on downscaled images so small
+        # plaques survive the opening
+        cleaned = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, self._morph_kernel,
+                                   iterations=max(1, int(round(2 * scale))))
 
-        # Find contours
-        contours, _ = cv2.findContours(
-            cleaned,
-            cv2.RETR_EXTERNAL,
-            cv2.CHAIN_APPROX_SIMPLE
+        # Area and centroid of every blob in one call (label 0 is the
+        # background). Grana's algorithm is several times faster than the
+        # default on CPU builds.
+        _, _, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(
+            cleaned, 8, cv2.CV_32S, cv2.CCL_GRANA
         )
-
-        detections = []
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            # Filter by area (plaques should be reasonably sized)
-            if 50 < area < 5000:
-                # Fit circle to contour
-                (x, y), radius = cv2.minEnclosingCircle(contour)
-                if radius > 5:
-                    detections.append({
-                        'x': int(x),
-                        'y': int(y),
-                        'radius': int(radius),
-                        'confidence': 0.7
-                    })
-
-        return detections
-
-    def non_max_suppression(self, detections, overlap_thresh=0.5):
-        """Remove overlapping detections"""
-        if len(detections) == 0:
-            return []
-
-        # Convert to numpy array
-        boxes = []
-        for det in detections:
-            x, y, r = det['x'], det['y'], det['radius']
-            boxes.append([x - r, y - r, x + r, y + r, det['confidence']])
-
-        boxes = np.array(boxes)
-
-        if len(boxes) == 0:
+        areas = stats[1:, cv2.CC_STAT_AREA].astype(np.float32)
+        centroids = centroids[1:].astype(np.float32)
+
+        # Size limits are tuned for full resolution
+        min_area = 50 * scale ** 2
+        max_area = 5000 * scale ** 2
+        min_radius = 5 * scale
+
+        # Half the longer bounding-box side, which matches the enclosing
+        # circle for round blobs and is not shrunk by holes in ring plaques
+        radii = np.maximum(
+            stats[1:, cv2.CC_STAT_WIDTH], stats[1:, cv2.CC_STAT_HEIGHT]
+        ).astype(np.float32) / 2
+        keep = (areas > min_area) & (areas < max_area) & (radii > min_radius)
+
+        return centroids[keep, 0], centroids[keep, 1], radii[keep]
+
+    def non_max_suppression(self, xs, ys, rs, confs, overlap_thresh=0.5):
+        """Remove overlapping detections
+
+        A circle is dropped when the intersection over union of its area
+        with a more confident kept circle exceeds ``overlap_thresh``.
+        Returns the indices of the kept detections, most confident first.
+        """
+        if len(xs) == 0:
             return []
 
-        # Sort by confidence
-        idxs = np.argsort(boxes[:, 4])
-
+        # Visit circles from the most confident down
+        order = np.argsort(confs)[::-1]
+
+        if nms_circles is not None and len(xs) > NUMBA_NMS_MIN_DETECTIONS:
+            return list(nms_circles(xs, ys, rs, np.ascontiguousarray(order),
+                                    overlap_thresh))
+
+        if len(xs) <= NMS_PAIRWISE_MAX_DETECTIONS:
+            # Pairwise circle IoU, then a greedy sweep
+            d2 = (xs[:, None] - xs[None, :]) ** 2 + (ys[:, None] - ys[None, :]) ** 2
+            overlap = _circle_iou(d2, rs[:, None], rs[None, :]) > overlap_thresh
+
+            alive = np.ones(len(xs), dtype=bool)
+            pick = []
+            for i in order:
+                if not alive[i]:
+                    continue
+                pick.append(i)
+                alive[overlap[i]] = False
+            return pick
+
+        # Too many for N x N temporaries: test each kept circle against the
+        # candidates still in play, so memory stays O(N)
+        xs, ys, rs = xs[order], ys[order], rs[order]
         pick = []
-        while len(idxs) > 0:
-            last = len(idxs) - 1
-            i = idxs[last]
-            pick.append(i)
-
-            # Find overlapping boxes
-            xx1 = np.maximum(boxes[i, 0], boxes[idxs[:last], 0])
-            yy1 = np.maximum(boxes[i, 1], boxes[idxs[:last], 1])
-            xx2 = np.minimum(boxes[i, 2], boxes[idxs[:last], 2])
-            yy2 = np.minimum(boxes[i, 3], boxes[idxs[:last], 3])
-
-            w = np.maximum(0, xx2 - xx1 + 1)
-            h = np.maximum(0, yy2 - yy1 + 1)
-
-            overlap = (w * h) / ((boxes[idxs[:last], 2] - boxes[idxs[:last], 0] + 1) *
-                                  (boxes[idxs[:last], 3] - boxes[idxs[:last], 1] + 1))
-
-            idxs = np.delete(idxs, np.concatenate(([last],
-                                                     np.where(overlap > overlap_thresh)[0])))
-
-        return [detections[i] for i in pick]
+        while len(order) > 0:
+            pick.append(order[0])
+            d2 = (xs[1:] - xs[0]) ** 2 + (ys[1:] - ys[0]) ** 2
+            # Only circles that actually cross need the IoU
+            keep = d2 >= (rs[1:] + rs[0]) ** 2
+            cross = ~keep
+            keep[cross] = _circle_iou(d2[cross], rs[0], rs[1:][cross]) <= overlap_thresh
+            order, xs, ys, rs = order[1:][keep], xs[1:][keep], ys[1:][keep], rs[1:][keep]
+
+        return pick
+
+    @staticmethod
+    def to_detections(xs, ys, rs, confs):
+        """Convert detection arrays into the list of dicts returned by the API"""
+        return [{
+            'x': int(x),
+            'y': int(y),
+            'radius': int(r),
+            'confidence': round(float(c), 2)
+        } for x, y, r, c in zip(xs, ys, rs, confs)]
 
     def detect(self, image_path):
         """Main detection method"""
-        img_bgr, img_rgb = self.preprocess_image(image_path)
+        st = os.stat(image_path)
+        enhanced, scale = self._load_enhanced(
+            image_path, st.st_mtime_ns, st.st_size
+        )
 
         # Perform segmentation
-        detections = self.segment_plaques(img_rgb)
+        detections = self.to_detections(*self.segment_plaques(enhanced, scale))
 
         # TODO: Add deep learning refinement for classification
         # For now, using traditional CV methods
 
         return detections
 
+    def classify(self, batch):
+        """Run the CNN on a batch of normalized images shaped (N, 3, H, W)
+
+        Weights stay FP32 so checkpoints keep full precision; on CUDA the
+        forward pass runs under BF16 autocast.
+        """
+        import torch
+
+        if self.onnx_session is not None:
+            logits = self.onnx_session.run(
+                None, {'input': batch.detach().cpu().numpy().astype(np.float32)}
+            )[0]
+            return torch.from_numpy(logits)
+
+        batch = batch.to(self.device, memory_format=torch.channels_last)
+        with torch.inference_mode(), torch.autocast(
+            device_type=self.device.type,
+            dtype=torch.bfloat16,
+            enabled=self.device.type == 'cuda'
+        ):
+            return self.model(batch).float()
+
     def retrain(self, annotations, upload_folder):
         """Retrain model with user feedback"""
         # Prepare training data from annotations
         training_data = []
 
+        # One directory scan instead of an exists() call per annotation
+        with os.scandir(upload_folder) as entries:
+            present = {entry.name for entry in entries if entry.is_file()}
+
         for annotation in annotations:
             image_id = annotation['image_id']
-            image_path = os.path.join(upload_folder, image_id)
-
-            if not os.path.exists(image_path):
+            if image_id not in present:
                 continue
 
+            image_path = os.path.join(upload_folder, image_id)
+
             corrections = annotation.get('corrections', [])
             actual_count = annotation.get('actual_count')
 
@@ -229,7 +478,9 @@ class PlaqueDetector:
             raise ValueError("Insufficient training data")
 
         # TODO: Implement training loop
-        # For now, just increment version
+        # For now, just increment version (loading the current checkpoint
+        # first, since that sets model_version)
+        self._ensure_model_loaded()
         self.model_version += 1
         self.save_model(f'model/checkpoints/version_{self.model_version}.pth')
 
@@ -237,6 +488,8 @@ class PlaqueDetector:
 
     def save_model(self, path):
         """Save model checkpoint"""
+        import torch
+
         os.makedirs(os.path.dirname(path), exist_ok=True)
         torch.save({
             'model_state_dict': self.model.state_dict(),
@@ -244,15 +497,52 @@ class PlaqueDetector:
         }, path)
 
         # Also save as latest
-        latest_path = 'model/checkpoints/latest.pth'
         torch.save({
             'model_state_dict': self.model.state_dict(),
             'version': self.model_version
-        }, latest_path)
+        }, CHECKPOINT_PATH)
+
+        self._write_version()
+
+        # Keep the exported graph in step with the latest weights
+        if ort is not None:
+            self.export_onnx(ONNX_PATH)
+            self.load_onnx(ONNX_PATH)
+
+    def _write_version(self):
+        """Record ``model_version`` in the sidecar read at startup"""
+        with open(VERSION_PATH, 'w') as f:
+            json.dump({'version': self.model_version}, f)
+
+    def export_onnx(self, path):
+        """Export the CNN to ONNX with a dynamic batch dimension"""
+        import torch
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        torch.onnx.export(
+            self.model,
+            torch.randn(1, 3, 224, 224, device=self.device),
+            path,
+            input_names=['input'],
+            output_names=['logits'],
+            opset_version=17,
+            dynamic_axes={'input': {0: 'B'}, 'logits': {0: 'B'}}
+        )
+
+    def load_onnx(self, path):
+        """Open an ONNX Runtime session, preferring TensorRT, then CUDA"""
+        preferred = ['TensorrtExecutionProvider', 'CUDAExecutionProvider',
+                     'CPUExecutionProvider']
+        available = ort.get_available_providers()
+        self.onnx_session = ort.InferenceSession(
+            path, providers=[p for p in preferred if p in available]
+        )
 
     def load_model(self, path):
         """Load model checkpoint"""
-        checkpoint = torch.load(path, map_location=self.device)
+        import torch
+
+        checkpoint = torch.load(path, map_location=self.device, weights_only=True)
         self.model.load_state_dict(checkpoint['model_state_dict'])
         self.model_version = checkpoint.get('version', 0)
         print(f"Loaded model version {self.model_version}")
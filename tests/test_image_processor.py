@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from utils.image_processor import ImageProcessor
+
+
+@pytest.mark.parametrize('grayscale', [True, False])
+def test_preprocess_for_detection_accepts_2d_input(grayscale):
+    processor = ImageProcessor()
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(120, 160), dtype=np.uint8)
+
+    result = processor.preprocess_for_detection(image, grayscale=grayscale)
+
+    assert result.shape == image.shape
+    assert result.dtype == np.uint8
+
+
+def test_preprocess_for_detection_2d_matches_gray_bgr():
+    processor = ImageProcessor()
+    rng = np.random.default_rng(1)
+    gray = rng.integers(0, 256, size=(120, 160), dtype=np.uint8)
+    bgr = np.repeat(gray[:, :, None], 3, axis=2)
+
+    np.testing.assert_array_equal(
+        processor.preprocess_for_detection(gray),
+        processor.preprocess_for_detection(bgr)
+    )
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import model.plaque_detector as plaque_detector
+from model.plaque_detector import PlaqueDetector
+
+
+@pytest.fixture
+def detector():
+    return PlaqueDetector()
+
+
+def circles(*rows):
+    xs, ys, rs, confs = (np.array(col, dtype=np.float32) for col in zip(*rows))
+    return xs, ys, rs, confs
+
+
+@pytest.mark.parametrize('distance', [20, 14, 12])
+def test_nms_keeps_adjacent_plaques(detector, distance):
+    # Touching (20 px) and slightly overlapping plaques are separate plaques
+    pick = detector.non_max_suppression(*circles(
+        (0, 0, 10, 0.8),
+        (distance, 0, 10, 0.7)
+    ))
+    assert sorted(pick) == [0, 1]
+
+
+def test_nms_drops_duplicate_detection(detector):
+    pick = detector.non_max_suppression(*circles(
+        (0, 0, 10, 0.7),
+        (1, 1, 11, 0.8)
+    ))
+    assert pick == [1]
+
+
+def test_nms_numba_matches_numpy(detector, monkeypatch):
+    if plaque_detector.nms_circles is None:
+        pytest.skip('numba not installed')
+
+    rng = np.random.default_rng(0)
+    n = plaque_detector.NUMBA_NMS_MIN_DETECTIONS * 4
+    args = (
+        rng.uniform(0, 200, n).astype(np.float32),
+        rng.uniform(0, 200, n).astype(np.float32),
+        rng.uniform(5, 20, n).astype(np.float32),
+        rng.uniform(0, 1, n).astype(np.float32)
+    )
+    compiled = detector.non_max_suppression(*args)
+
+    monkeypatch.setattr(plaque_detector, 'nms_circles', None)
+    assert compiled == detector.non_max_suppression(*args)
+
+
+def test_nms_sweep_matches_pairwise(detector, monkeypatch):
+    monkeypatch.setattr(plaque_detector, 'nms_circles', None)
+
+    rng = np.random.default_rng(1)
+    n = 300
+    args = (
+        rng.uniform(0, 200, n).astype(np.float32),
+        rng.uniform(0, 200, n).astype(np.float32),
+        rng.uniform(5, 20, n).astype(np.float32),
+        rng.uniform(0, 1, n).astype(np.float32)
+    )
+    pairwise = detector.non_max_suppression(*args)
+
+    monkeypatch.setattr(plaque_detector, 'NMS_PAIRWISE_MAX_DETECTIONS', 0)
+    assert pairwise == detector.non_max_suppression(*args)
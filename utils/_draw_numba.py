@@ -0,0 +1,97 @@
+import numba
+import numpy as np
+
+
+@numba.njit(parallel=True, cache=True)
+def draw_circles(img, xs, ys, rs, color_idx, palette, thickness):
+    """Draw circle outlines ``thickness`` px wide onto a BGR image in place
+
+    Each image row is handled by one thread, which walks all circles and
+    fills the span of the ring crossing that row, so no two threads write
+    the same pixel. Later circles overwrite earlier ones, as with repeated
+    ``cv2.circle`` calls. Edges are not anti-aliased.
+    """
+    h, w = img.shape[0], img.shape[1]
+    half = thickness / 2.0
+
+    for y in numba.prange(h):
+        for i in range(xs.shape[0]):
+            dy = float(y - ys[i])
+            outer = rs[i] + half
+            if dy * dy > outer * outer:
+                continue
+
+            xo = np.sqrt(outer * outer - dy * dy)
+            inner = rs[i] - half
+            xi = 0.0
+            if inner > 0 and dy * dy < inner * inner:
+                xi = np.sqrt(inner * inner - dy * dy)
+
+            color = palette[color_idx[i]]
+            # Left and right arcs of the ring on this row
+            for lo, hi in ((xs[i] - xo, xs[i] - xi), (xs[i] + xi, xs[i] + xo)):
+                for x in range(max(int(np.ceil(lo)), 0), min(int(np.floor(hi)), w - 1) + 1):
+                    for ch in range(3):
+                        img[y, x, ch] = color[ch]
+
+
+@numba.njit(parallel=True, cache=True)
+def draw_labels(img, xs, ys, color_idx, palette, glyphs, pad):
+    """Draw the numbers 1..N on filled boxes centred on each detection
+
+    ``glyphs`` holds a (height, width) mask for each digit 0-9; digits are
+    drawn white inside a box of the detection's color with ``pad`` pixels
+    of margin. Rows are split across threads as in ``draw_circles``.
+    """
+    h, w = img.shape[0], img.shape[1]
+    gh, gw = glyphs.shape[1], glyphs.shape[2]
+    bh = gh + 2 * pad
+    n = xs.shape[0]
+
+    # Decimal digits of each label, most significant first
+    ndigits = np.ones(n, dtype=np.int64)
+    digits = np.zeros((n, 20), dtype=np.int64)
+    for i in range(n):
+        label = i + 1
+        while label >= 10 ** ndigits[i]:
+            ndigits[i] += 1
+        for k in range(ndigits[i] - 1, -1, -1):
+            digits[i, k] = label % 10
+            label //= 10
+
+    for y in numba.prange(h):
+        for i in range(n):
+            top = ys[i] - bh // 2
+            if y < top or y >= top + bh:
+                continue
+
+            bw = ndigits[i] * gw + 2 * pad
+            left = xs[i] - bw // 2
+            b, g, r = palette[color_idx[i], 0], palette[color_idx[i], 1], palette[color_idx[i], 2]
+
+            # Box background, then the white strokes of this row of the text
+            for x in range(max(left, 0), min(left + bw, w)):
+                img[y, x, 0] = b
+                img[y, x, 1] = g
+                img[y, x, 2] = r
+
+            gy = y - top - pad
+            if gy < 0 or gy >= gh:
+                continue
+            for k in range(ndigits[i]):
+                glyph = glyphs[digits[i, k], gy]
+                x0 = left + pad + k * gw
+                for gx in range(max(-x0, 0), min(gw, w - x0)):
+                    if glyph[gx]:
+                        img[y, x0 + gx, 0] = 255
+                        img[y, x0 + gx, 1] = 255
+                        img[y, x0 + gx, 2] = 255
+
+
+# Compile (or load from cache) at import so the first request doesn't pay for it
+_img = np.zeros((4, 4, 3), dtype=np.uint8)
+_pos = np.ones(1, dtype=np.int32)
+_idx = np.zeros(1, dtype=np.int64)
+_palette = np.zeros((1, 3), dtype=np.uint8)
+draw_circles(_img, _pos, _pos, _pos, _idx, _palette, 2)
+draw_labels(_img, _pos, _pos, _idx, _palette, np.zeros((10, 1, 1), dtype=np.uint8), 1)
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import threading
+import orjson
+
+
+class AnnotationStore:
+    """User feedback kept in a single SQLite database
+
+    Each thread gets its own connection; the database runs in WAL mode so
+    reads never wait on a feedback write. A new database imports the
+    per-image JSON files written by earlier versions from ``legacy_folder``.
+    """
+
+    def __init__(self, db_path, legacy_folder=None):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS annotations ('
+                'image_id TEXT PRIMARY KEY, '
+                'actual_count INTEGER, '
+                'corrections BLOB, '
+                'timestamp TEXT)'
+            )
+
+        if legacy_folder is not None and self.count() == 0:
+            self._import_json_files(legacy_folder)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(annotation):
+        return (
+            annotation['image_id'],
+            annotation.get('actual_count'),
+            orjson.dumps(annotation.get('corrections', [])),
+            annotation.get('timestamp')
+        )
+
+    def _import_json_files(self, folder):
+        rows = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json') and entry.is_file(follow_symlinks=False):
+                    with open(entry.path, 'rb') as f:
+                        rows.append(self._row(orjson.loads(f.read())))
+
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?)', rows
+            )
+
+    def save(self, annotation):
+        """Store an annotation, replacing any earlier one for the same image"""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?)',
+                self._row(annotation)
+            )
+
+    def all(self):
+        """Return every annotation, newest first"""
+        rows = self._connect().execute(
+            'SELECT image_id, actual_count, corrections, timestamp '
+            'FROM annotations ORDER BY timestamp DESC'
+        ).fetchall()
+        return [{
+            'image_id': image_id,
+            'actual_count': actual_count,
+            'corrections': orjson.loads(corrections),
+            'timestamp': timestamp
+        } for image_id, actual_count, corrections, timestamp in rows]
+
+    def count(self):
+        """Number of images with feedback"""
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM annotations'
+        ).fetchone()[0]
@@ -1,120 +1,416 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.patches import Circle
 import os
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from utils.opencv_helpers import ThreadLocalCLAHE, cuda_device_count
+
+try:
+    from utils._draw_numba import draw_circles, draw_labels
+except ImportError:  # optional: visualizations are drawn with cv2 calls only
+    draw_circles = draw_labels = None
+
+# Visualization colors (BGR): red up to 0.6 confidence, yellow up to 0.8,
+# green above
+CONFIDENCE_BINS = np.array([0.6, 0.8])
+CONFIDENCE_COLORS = ((0, 0, 255), (0, 255, 255), (0, 255, 0))
+_CONFIDENCE_PALETTE = np.array(CONFIDENCE_COLORS, dtype=np.uint8)
+
+# Above this many detections the compiled rasterizer beats one cv2.circle and
+# cv2.putText call per detection
+NUMBA_DRAW_MIN_DETECTIONS = 500
+
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# Encoder settings for visualizations by file extension. PNG keeps OpenCV's
+# defaults, which are already its fastest setting; any explicit compression
+# level switches zlib off the RLE strategy and is slower.
+_WRITE_PARAMS = {
+    '.jpg': [cv2.IMWRITE_JPEG_QUALITY, 90],
+    '.jpeg': [cv2.IMWRITE_JPEG_QUALITY, 90],
+}
+
+# With preview_scale, images larger than this on the long side are decoded at
+# half size for visualization
+PREVIEW_MIN_DIM = 2000
+
+# Shared by all processors for preprocess_batch; OpenCV releases the GIL, so
+# images are decoded and enhanced in parallel
+_preprocess_pool = ThreadPoolExecutor(max_workers=os.cpu_count(),
+                                      thread_name_prefix='preprocess')
+
+
+@functools.lru_cache(maxsize=4)
+def _digit_glyphs(font_scale, thickness):
+    """Masks of the digits 0-9 as cv2.putText draws them, shaped (10, h, w)"""
+    (w, h), baseline = cv2.getTextSize('0', LABEL_FONT, font_scale, thickness)
+    glyphs = np.zeros((10, h + baseline, w), dtype=np.uint8)
+    for digit in range(10):
+        glyph = np.zeros(glyphs.shape[1:], dtype=np.uint8)
+        cv2.putText(glyph, str(digit), (0, h), LABEL_FONT, font_scale, 1,
+                    thickness, cv2.LINE_8)
+        glyphs[digit] = glyph
+    return glyphs
+
+
+@functools.lru_cache(maxsize=2)
+def _cached_imread(image_path, mtime, size, flags=cv2.IMREAD_COLOR):
+    """Decode an image file, memoized on its path, mtime and size
+
+    ``mtime`` and ``size`` are only part of the key, so a file replaced on
+    disk is decoded again. Entries are full-resolution decodes, so only the
+    last couple are kept. The array is shared by every caller, so it is
+    marked read-only.
+    """
+    img = cv2.imread(image_path, flags)
+    if img is None:
+        raise ValueError(f"Could not load image: {image_path}")
+    img.flags.writeable = False
+    return img
+
+
+def _as_uint8(image):
+    """Return ``image`` as 8-bit, converting only if it isn't already
+
+    CLAHE, the color conversions and the blur all run on their 8-bit paths;
+    a float image would silently take the much slower float32 ones. 16-bit
+    images keep their high byte, anything else saturates to 0-255.
+    """
+    if image.dtype == np.uint8:
+        return image
+    if image.dtype == np.uint16:
+        return (image >> 8).astype(np.uint8)
+    return np.clip(image, 0, 255).astype(np.uint8)
 
 
 class ImageProcessor:
     """Utility class for image processing and visualization"""
 
-    def create_visualization(self, image_path, detections, output_path):
+    # Noise filters for preprocess_for_detection: 5- or 3-tap Gaussian (sigma
+    # derived from the size, as GaussianBlur does) or a 3x3 box filter for
+    # low-noise images
+    _BLUR_SIZES = {'gauss5': 5, 'gauss3': 3, 'box3': 3}
+    _GAUSS_KERNELS = {
+        'gauss5': cv2.getGaussianKernel(5, 0),
+        'gauss3': cv2.getGaussianKernel(3, 0),
+    }
+
+    def __init__(self, preview_scale=False):
+        self.preview_scale = preview_scale
+
+        # Per-thread scratch buffers and CUDA state (see _scratch)
+        self._local = threading.local()
+
+        # Run preprocessing on the GPU when OpenCV was built with CUDA
+        self.use_cuda = cuda_device_count() > 0
+
+    clahe = ThreadLocalCLAHE(clip_limit=3.0)
+
+    def _scratch(self, name, shape):
+        """Per-thread buffer reused across calls while the image shape stays the same
+
+        Only for intermediates: anything returned to a caller must be freshly
+        allocated, or the next call would overwrite it.
+        """
+        buf = getattr(self._local, name, None)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, np.uint8)
+            setattr(self._local, name, buf)
+        return buf
+
+    def _cuda_state(self):
+        """Per-thread CUDA stream, device buffer and filters
+
+        Each preprocess_batch worker gets its own stream, so uploads,
+        kernels and downloads from different threads overlap.
+        """
+        state = getattr(self._local, 'cuda', None)
+        if state is None:
+            state = {
+                'stream': cv2.cuda_Stream(),
+                'upload': cv2.cuda_GpuMat(),
+                'clahe': cv2.cuda.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8)),
+                # Noise filters, keyed by (blur, type), built on first use
+                'filters': {},
+            }
+            self._local.cuda = state
+        return state
+
+    def _cuda_blur_filter(self, state, blur, cv_type):
+        """The CUDA filter for ``blur`` on images of ``cv_type``"""
+        key = (blur, cv_type)
+        if key not in state['filters']:
+            size = self._BLUR_SIZES[blur]
+            if blur == 'box3':
+                filt = cv2.cuda.createBoxFilter(cv_type, cv_type, (size, size))
+            else:
+                filt = cv2.cuda.createGaussianFilter(cv_type, cv_type, (size, size), 0)
+            state['filters'][key] = filt
+        return state['filters'][key]
+
+    def _preprocess_cuda(self, img, grayscale, blur):
+        """preprocess_for_detection on the GPU: one upload, one download
+
+        CUDA filters take 1 or 4 channels, so color images are blurred as
+        BGRA.
+        """
+        state = self._cuda_state()
+        stream = state['stream']
+
+        gpu = state['upload']
+        gpu.upload(img, stream)
+
+        if img.ndim == 2:
+            enhanced = state['clahe'].apply(gpu, stream)
+            cv_type = cv2.CV_8UC1
+        elif grayscale:
+            gray = cv2.cuda.cvtColor(gpu, cv2.COLOR_BGR2GRAY, stream=stream)
+            enhanced = state['clahe'].apply(gray, stream)
+            cv_type = cv2.CV_8UC1
+        else:
+            lab = cv2.cuda.cvtColor(gpu, cv2.COLOR_BGR2LAB, stream=stream)
+            l, a, b = cv2.cuda.split(lab, stream=stream)
+            l = state['clahe'].apply(l, stream)
+            lab = cv2.cuda.merge([l, a, b], stream=stream)
+            enhanced = cv2.cuda.cvtColor(lab, cv2.COLOR_LAB2BGR, dcn=4, stream=stream)
+            cv_type = cv2.CV_8UC4
+
+        blurred = self._cuda_blur_filter(state, blur, cv_type).apply(
+            enhanced, stream=stream
+        )
+        if cv_type == cv2.CV_8UC4:
+            blurred = cv2.cuda.cvtColor(blurred, cv2.COLOR_BGRA2BGR, stream=stream)
+        blurred = blurred.download(stream)
+        stream.waitForCompletion()
+        return blurred
+
+    def load_image(self, image, flags=cv2.IMREAD_COLOR):
+        """Return ``image`` itself if it is already decoded, else decode the path
+
+        Decoded files come from a cache shared by all processors and are
+        read-only; copy before modifying.
+        """
+        if isinstance(image, np.ndarray):
+            return image
+        st = os.stat(image)
+        return _cached_imread(image, st.st_mtime_ns, st.st_size, flags)
+
+    def _load_preview(self, image):
+        """Load an image for drawing, returning it and its scale to full size
+
+        Large files are decoded at half size when ``preview_scale`` is set;
+        for JPEGs libjpeg scales while decoding.
+        """
+        if self.preview_scale and not isinstance(image, np.ndarray):
+            try:
+                with Image.open(image) as im:
+                    long_side = max(im.size)
+            except Image.DecompressionBombError:
+                # Too many pixels for Pillow, so certainly worth halving
+                long_side = PREVIEW_MIN_DIM + 1
+            except OSError:
+                long_side = 0
+            if long_side > PREVIEW_MIN_DIM:
+                return self.load_image(image, cv2.IMREAD_REDUCED_COLOR_2), 0.5
+
+        return self.load_image(image), 1.0
+
+    def create_visualization(self, image, detections, output_path):
         """
         Create visualization with detected plaques highlighted
 
         Args:
-            image_path: Path to original image
+            image: Path to original image, or the decoded BGR image
             detections: List of detection dictionaries
             output_path: Path to save visualization
 
         Returns:
             Path to saved visualization
         """
-        # Load image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Could not load image: {image_path}")
+        # Load image; drawing happens on a copy so cached or caller-owned
+        # images are left untouched
+        img, scale = self._load_preview(image)
+        img = img.copy()
+
+        # Line widths and text grow with the image so they stay legible
+        # when large scans are shown scaled down
+        size = max(1, round(max(img.shape[:2]) / 1000))
+        font = LABEL_FONT
+        font_scale = 0.5 * size
 
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        # Detections are in full-resolution pixels
+        n = len(detections)
+        xs = np.fromiter((d['x'] for d in detections), dtype=np.float64, count=n)
+        ys = np.fromiter((d['y'] for d in detections), dtype=np.float64, count=n)
+        rs = np.fromiter((d['radius'] for d in detections), dtype=np.float64, count=n)
+        xs = np.rint(xs * scale).astype(np.int32)
+        ys = np.rint(ys * scale).astype(np.int32)
+        rs = np.maximum(np.rint(rs * scale), 1).astype(np.int32)
+        confs = np.fromiter((d.get('confidence', 1.0) for d in detections),
+                            dtype=np.float64, count=n)
 
-        # Create visualization
-        fig, ax = plt.subplots(1, figsize=(12, 12))
-        ax.imshow(img_rgb)
-        ax.axis('off')
+        # Color index per detection, in one pass
+        color_idx = np.digitize(confs, CONFIDENCE_BINS, right=True)
+
+        if draw_circles is not None and n > NUMBA_DRAW_MIN_DETECTIONS:
+            # All outlines, then all numbered boxes, in two parallel passes
+            draw_circles(img, xs, ys, rs, color_idx, _CONFIDENCE_PALETTE, 2 * size)
+            draw_labels(img, xs, ys, color_idx, _CONFIDENCE_PALETTE,
+                        _digit_glyphs(font_scale, size), 2)
+            detections_to_draw = ()
+        else:
+            detections_to_draw = zip(xs.tolist(), ys.tolist(), rs.tolist(),
+                                     color_idx.tolist())
 
         # Draw circles for each detection
-        for i, detection in enumerate(detections):
-            x = detection['x']
-            y = detection['y']
-            r = detection['radius']
-            confidence = detection.get('confidence', 1.0)
-
-            # Color based on confidence (green = high, yellow = medium, red = low)
-            if confidence > 0.8:
-                color = 'lime'
-            elif confidence > 0.6:
-                color = 'yellow'
-            else:
-                color = 'red'
+        for i, (x, y, r, c) in enumerate(detections_to_draw):
+            color = CONFIDENCE_COLORS[c]
 
             # Draw circle
-            circle = Circle((x, y), r, fill=False, edgecolor=color,
-                            linewidth=2, alpha=0.8)
-            ax.add_patch(circle)
+            cv2.circle(img, (x, y), r, color, 2 * size, cv2.LINE_AA)
 
-            # Add label with number
-            ax.text(x, y, str(i + 1), color='white',
-                    fontsize=10, ha='center', va='center',
-                    bbox=dict(boxstyle='round', facecolor=color, alpha=0.7))
+            # Add label with number on a filled box
+            label = str(i + 1)
+            (tw, th), baseline = cv2.getTextSize(label, font, font_scale, size)
+            cv2.rectangle(img, (x - tw // 2 - 2, y - th // 2 - 2),
+                          (x + tw // 2 + 2, y + th // 2 + baseline), color, -1)
+            cv2.putText(img, label, (x - tw // 2, y + th // 2), font,
+                        font_scale, (255, 255, 255), size, cv2.LINE_AA)
 
         # Add title with count
-        ax.set_title(f'Detected Plaques: {len(detections)}',
-                     fontsize=16, fontweight='bold', pad=20)
+        title = f'Detected Plaques: {len(detections)}'
+        (tw, th), baseline = cv2.getTextSize(title, font, 2 * font_scale, 2 * size)
+        cv2.rectangle(img, (0, 0), (tw + 20 * size, th + baseline + 20 * size),
+                      (0, 0, 0), -1)
+        cv2.putText(img, title, (10 * size, th + 10 * size), font,
+                    2 * font_scale, (255, 255, 255), 2 * size, cv2.LINE_AA)
 
-        # Save figure
-        plt.tight_layout()
-        plt.savefig(output_path, dpi=150, bbox_inches='tight')
-        plt.close()
+        # Save image, as PNG when the extension has no OpenCV writer
+        ext = os.path.splitext(output_path)[1].lower()
+        if not ext or not cv2.haveImageWriter(output_path):
+            ext = '.png'
+        ok, encoded = cv2.imencode(ext, img, _WRITE_PARAMS.get(ext, []))
+        if not ok:
+            raise ValueError(f"Could not write visualization: {output_path}")
+        with open(output_path, 'wb') as f:
+            f.write(encoded)
 
         return output_path
 
-    def apply_mask(self, image, mask):
-        """Apply binary mask to image"""
-        return cv2.bitwise_and(image, image, mask=mask)
+    def apply_mask(self, image, mask, out=None):
+        """Apply binary mask to image
+
+        Pass ``out`` (same shape and dtype as ``image``) to reuse a buffer
+        instead of allocating a new image on every call.
+        """
+        if out is None:
+            return cv2.bitwise_and(image, image, mask=mask)
+
+        # bitwise_and leaves dst untouched where the mask is zero
+        out.fill(0)
+        return cv2.bitwise_and(image, image, dst=out, mask=mask)
+
+    def apply_mask_inplace(self, image, mask):
+        """Zero the pixels of ``image`` outside the mask, in place
 
-    def enhance_contrast(self, image):
-        """Enhance image contrast using CLAHE"""
+        ``image`` must be uint8, as for ``apply_mask``.
+        """
+        # 255 inside the mask and 0 outside, so AND keeps or clears each pixel
+        keep = cv2.compare(mask, 0, cv2.CMP_NE,
+                           dst=self._scratch('mask', mask.shape[:2]))
+        if image.ndim == 3:
+            keep = keep[:, :, None]
+        np.bitwise_and(image, keep, out=image)
+        return image
+
+    def enhance_contrast(self, image, dst=None):
+        """Enhance image contrast using CLAHE (color images are BGR)
+
+        The result is written to ``dst`` when it matches the image's shape
+        and dtype, as with OpenCV's own ``dst`` arguments.
+        """
+        image = _as_uint8(image)
         if len(image.shape) == 3:
-            # Convert to LAB color space
-            lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
-            l, a, b = cv2.split(lab)
+            # Convert to LAB color space, reusing this thread's buffers
+            lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB,
+                               dst=self._scratch('lab', image.shape))
 
-            # Apply CLAHE to L channel
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-            l = clahe.apply(l)
+            # Apply CLAHE to a contiguous copy of the L channel and write it
+            # back in place; a and b are never split out or merged back
+            l = self._scratch('l', image.shape[:2])
+            np.copyto(l, lab[:, :, 0])
+            lab[:, :, 0] = self.clahe.apply(l, dst=l)
 
-            # Merge channels
-            enhanced = cv2.merge([l, a, b])
-            enhanced = cv2.cvtColor(enhanced, cv2.COLOR_LAB2RGB)
+            enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=dst)
         else:
             # Grayscale image
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-            enhanced = clahe.apply(image)
+            enhanced = self.clahe.apply(image, dst=dst)
 
         return enhanced
 
-    def preprocess_for_detection(self, image_path):
+    def _blur(self, image, blur):
+        """Apply the noise filter named by ``blur``"""
+        if blur == 'box3':
+            return cv2.boxFilter(image, -1, (3, 3))
+
+        # Gaussian as two 1D passes
+        kernel = self._GAUSS_KERNELS[blur]
+        return cv2.sepFilter2D(image, -1, kernel, kernel)
+
+    def preprocess_for_detection(self, image, grayscale=True, blur='gauss5'):
         """
         Preprocess image to enhance plaque visibility
 
+        Args:
+            image: Path to the image, or the decoded BGR or grayscale image
+            grayscale: Collapse to one channel before enhancing; plaque
+                detection does not use color, and CLAHE and blur then touch
+                a third of the data
+            blur: Noise filter: 'gauss5' (default), 'gauss3', or 'box3' for
+                a cheaper pass on low-noise images
+
         Returns:
-            Preprocessed image array
+            Preprocessed image array (grayscale, or BGR when the input is
+            color and ``grayscale`` is False)
         """
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Could not load image: {image_path}")
+        if blur not in self._BLUR_SIZES:
+            raise ValueError(f"Unknown blur: {blur!r}")
+
+        img = _as_uint8(self.load_image(image))
+        if self.use_cuda:
+            return self._preprocess_cuda(img, grayscale, blur)
 
-        # Convert to RGB
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        if grayscale and img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY,
+                               dst=self._scratch('gray', img.shape[:2]))
 
-        # Enhance contrast
-        enhanced = self.enhance_contrast(img_rgb)
+        # Enhance contrast into a reused buffer; only the blurred result is
+        # handed back, and it is always a new array
+        enhanced = self.enhance_contrast(
+            img, dst=self._scratch('enhanced', img.shape)
+        )
 
-        # Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(enhanced, (5, 5), 0)
+        # Blur to reduce noise
+        blurred = self._blur(enhanced, blur)
 
         return blurred
 
+    def preprocess_batch(self, images, grayscale=True, blur='gauss5'):
+        """Run preprocess_for_detection on several images in parallel
+
+        Args:
+            images: Paths or decoded BGR images
+            grayscale, blur: Passed through to preprocess_for_detection
+
+        Returns:
+            List of preprocessed images, in input order
+        """
+        preprocess = functools.partial(self.preprocess_for_detection,
+                                       grayscale=grayscale, blur=blur)
+        return list(_preprocess_pool.map(preprocess, images))
+
     def crop_region(self, image, x, y, size):
         """Crop a region from image centered at (x, y)"""
         h, w = image.shape[:2]
@@ -126,3 +422,22 @@ class ImageProcessor:
         y2 = min(h, y + half_size)
 
         return image[y1:y2, x1:x2]
+
+    def crop_regions(self, image, xs, ys, size):
+        """Crop one region per (x, y) center, like crop_region for each pair
+
+        Bounds for all regions are clamped in one vectorized pass; the
+        returned crops are views into ``image``, not copies.
+        """
+        h, w = image.shape[:2]
+        half_size = size // 2
+        xs = np.asarray(xs, dtype=np.intp)
+        ys = np.asarray(ys, dtype=np.intp)
+
+        x1 = np.clip(xs - half_size, 0, w).tolist()
+        y1 = np.clip(ys - half_size, 0, h).tolist()
+        x2 = np.clip(xs + half_size, 0, w).tolist()
+        y2 = np.clip(ys + half_size, 0, h).tolist()
+
+        return [image[top:bottom, left:right]
+                for left, top, right, bottom in zip(x1, y1, x2, y2)]
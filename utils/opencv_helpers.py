@@ -0,0 +1,34 @@
+import threading
+import cv2
+
+
+def cuda_device_count():
+    """Number of CUDA devices usable by OpenCV (0 for CPU-only builds)"""
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount()
+    except (AttributeError, cv2.error):
+        return 0
+
+
+class ThreadLocalCLAHE:
+    """Class attribute giving each thread its own CLAHE object
+
+    apply() keeps its working buffers in the object, so concurrent calls on
+    a shared instance corrupt each other's output; building one allocates
+    its LUT tables, so each thread's object is reused across calls.
+    """
+
+    def __init__(self, clip_limit, tile_grid_size=(8, 8)):
+        self.clip_limit = clip_limit
+        self.tile_grid_size = tile_grid_size
+        self._local = threading.local()
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        clahe = getattr(self._local, 'clahe', None)
+        if clahe is None:
+            clahe = cv2.createCLAHE(clipLimit=self.clip_limit,
+                                    tileGridSize=self.tile_grid_size)
+            self._local.clahe = clahe
+        return clahe